@@ -0,0 +1,69 @@
+# Shared PersistentClient
+# =======================
+# Opening a PersistentClient means opening the database files on disk and
+# reading the search index back into memory. That takes time!
+#
+# get_client() opens each database folder only ONCE and then keeps handing
+# back the same client - like leaving the filing cabinet unlocked while
+# you're still working instead of locking and unlocking it for every file.
+
+import os
+import sqlite3
+from functools import lru_cache
+
+import chromadb
+from chromadb.api.types import EmbeddingFunction
+
+
+# lru_cache remembers one client per path, so get_client("./chroma_db")
+# always returns the same object within a program run.
+@lru_cache(maxsize=None)
+def get_client(path):
+    client = chromadb.PersistentClient(path=path)
+    if os.environ.get("CHROMA_FAST_IO") == "1":
+        _enable_fast_io(path)
+    return client
+
+
+# Optional speed-up for bulk writes, turned on with CHROMA_FAST_IO=1.
+# We switch ChromaDB's database file to SQLite's "WAL" journal: writes are
+# appended to a log instead of rewriting pages in place, so SQLite waits for
+# the disk less often. The setting is stored IN the file, so it keeps working
+# when ChromaDB opens the database with its own connection.
+# Other settings (synchronous, cache_size, mmap_size...) only apply to the
+# connection that sets them and can't reach ChromaDB's connection, so we
+# don't try. It's opt-in because it changes the database file for good and
+# SQLite then keeps two extra files (-wal and -shm) next to it.
+# SQLite answers with the journal mode it ended up in; if it couldn't switch
+# (e.g. the database is busy) that's still the old mode, so we check it.
+def _enable_fast_io(path):
+    try:
+        conn = sqlite3.connect(os.path.join(path, "chroma.sqlite3"))
+        try:
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        mode = f"error: {e}"
+    if mode.lower() != "wal":
+        print(f"CHROMA_FAST_IO: could not switch to WAL ({mode}), keeping the defaults")
+
+
+# Stand-in embedding function for collections we only search with
+# ready-made query vectors. It never loads a model; if something tries to
+# embed text with it, it raises an error instead.
+class _ReadOnlyEmbeddingFunction(EmbeddingFunction):
+    def __call__(self, input):
+        raise RuntimeError("read-only: pass query_embeddings instead of text")
+
+
+# Search a saved collection with a query vector you already have.
+# Because we hand ChromaDB the finished vector, the embedding model is never
+# loaded - handy for scripts that only search and never add documents.
+def query_only(path, name, query_vec, n_results=1):
+    collection = get_client(path).get_collection(
+        name=name,
+        embedding_function=_ReadOnlyEmbeddingFunction()
+    )
+    return collection.query(query_embeddings=[query_vec], n_results=n_results)
+
@@ -0,0 +1,250 @@
+# Shared Embedding Functions
+# ==========================
+# Loading an embedding model is the slowest part of starting these demos.
+# The default model (all-MiniLM-L6-v2) has to be read from disk and set up
+# in memory before it can turn any text into numbers.
+#
+# Instead of loading a fresh copy every time we need it, we load it ONCE
+# and hand out the same copy to everyone who asks - like sharing one
+# dictionary in the office instead of buying a new one for each question.
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils import embedding_functions
+
+
+# A name for an embedding function's model, used to keep cached vectors of
+# different models apart. Falls back to the class name.
+def _model_name(ef):
+    return getattr(ef, "model_name", type(ef).__name__)
+
+
+# lru_cache(maxsize=1) remembers the result of the first call.
+# Every later call gets the exact same embedding function back instantly.
+@lru_cache(maxsize=1)
+def get_default_ef():
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+# Wraps another embedding function and scales every vector to length 1.
+# Once all vectors have length 1, "cosine" and "inner product" give the same
+# ranking, but inner product ("hnsw:space": "ip") is cheaper to compute.
+# So we do the scaling ONCE when a document is added, instead of ChromaDB
+# doing it again on every search.
+class NormalizedEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, inner):
+        self._inner = inner
+        # Named after the model inside, so CachedEmbeddingFunction never mixes
+        # up the vectors of two different wrapped models
+        self.model_name = f"normalized/{_model_name(inner)}"
+
+    def __call__(self, input):
+        vectors = np.asarray(self._inner(input), dtype=np.float32)
+        # numpy divides every row by its own length in one step (no Python loop)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return list(vectors)
+
+
+@lru_cache(maxsize=1)
+def get_normalized_ef():
+    return NormalizedEmbeddingFunction(get_default_ef())
+
+
+# Where ChromaDB keeps its downloaded copy of all-MiniLM-L6-v2
+MINILM_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "chroma", "onnx_models", "all-MiniLM-L6-v2", "onnx"
+)
+
+
+# Runs an all-MiniLM-L6-v2 ONNX model ourselves with ONNX Runtime.
+# Pointed at a half-precision (FP16) copy of the model, the weights take half
+# the memory to read through on every call. We also switch on all of ONNX
+# Runtime's graph optimizations. The vectors come back as normal float32,
+# scaled to length 1, so they work with any collection.
+class OnnxMiniLMEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, model_path, tokenizer_path=os.path.join(MINILM_DIR, "tokenizer.json")):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        # All texts are tokenized in ONE call and padded to the same length,
+        # so the whole batch goes through the model in a single run.
+        # Texts are cut at 256 tokens, the same limit ChromaDB's default uses.
+        self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._tokenizer.enable_truncation(max_length=256)
+        self._tokenizer.enable_padding()
+        # Used by CachedEmbeddingFunction to keep FP16 and FP32 vectors apart
+        self.model_name = f"all-MiniLM-L6-v2/{os.path.basename(model_path)}"
+
+    def __call__(self, input):
+        encoded = self._tokenizer.encode_batch(list(input))
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        hidden = self._session.run(None, feeds)[0].astype(np.float32)
+        # Average the word vectors (ignoring padding), then scale to length 1
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        pooled /= np.linalg.norm(pooled, axis=1, keepdims=True)
+        return list(pooled)
+
+
+FP16_MODEL_PATH = os.path.join(MINILM_DIR, "model_fp16.onnx")
+
+
+# ChromaDB only downloads the normal (FP32) model, so we make the FP16 copy
+# ourselves, once, and save it next to the original. This needs the optional
+# onnxconverter-common package: pip install onnxconverter-common
+# keep_io_types=True keeps the model's outputs in float32.
+def make_fp16_model(src=os.path.join(MINILM_DIR, "model.onnx"), dst=FP16_MODEL_PATH):
+    import onnx
+    from onnxconverter_common import float16
+
+    model = float16.convert_float_to_float16(onnx.load(src), keep_io_types=True)
+    onnx.save(model, dst)
+    return dst
+
+
+# The FP16 embedding function, converting the model first if we haven't yet
+@lru_cache(maxsize=None)
+def get_fp16_ef(model_path=FP16_MODEL_PATH):
+    if not os.path.exists(model_path):
+        make_fp16_model(dst=model_path)
+    return OnnxMiniLMEmbeddingFunction(model_path)
+
+
+# OpenAI embedding function that sends its requests in parallel.
+# OpenAI accepts many texts per request, so we split the input into chunks
+# of 512 and send every chunk at the same time with asyncio.gather().
+# With lots of documents we wait for ONE round trip instead of one per chunk -
+# like sending several couriers at once instead of one after the other.
+class AsyncOpenAIEmbeddingFunction(embedding_functions.OpenAIEmbeddingFunction):
+    chunk_size = 512
+
+    def __init__(self, model_name, api_key):
+        super().__init__(model_name=model_name, api_key=api_key)
+        self._async_model_name = model_name
+        self._async_api_key = api_key
+
+    def __call__(self, input):
+        # asyncio.run() can't start a second event loop inside one that is
+        # already running (Jupyter notebooks have one), so there we use the
+        # normal one-request-at-a-time version instead
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            return super().__call__(input)
+
+        texts = list(input)
+        chunks = [
+            texts[i:i + self.chunk_size]
+            for i in range(0, len(texts), self.chunk_size)
+        ]
+        results = asyncio.run(self._embed_chunks(chunks))
+        return [vector for chunk in results for vector in chunk]
+
+    # Every call to __call__ runs its own asyncio event loop, so the async
+    # client (and its network connections) is opened inside that loop and
+    # shared by all chunks of the call: one connection setup per batch.
+    async def _embed_chunks(self, chunks):
+        import openai
+
+        async with openai.AsyncOpenAI(api_key=self._async_api_key) as client:
+            return await asyncio.gather(*[self._embed(client, chunk) for chunk in chunks])
+
+    async def _embed(self, client, chunk):
+        response = await client.embeddings.create(
+            model=self._async_model_name,
+            input=chunk
+        )
+        return [item.embedding for item in response.data]
+
+
+# Wraps another embedding function and remembers its results ON DISK.
+# Each text is fingerprinted (hashed) together with the model name. If we've
+# embedded that exact text with that model before, we read the saved vector
+# from a small SQLite file instead of calling the model (or paying OpenAI!)
+# again. Only texts we haven't seen before are sent to the real model.
+class CachedEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, inner, cache_path="./emb_cache.sqlite"):
+        self._inner = inner
+        self._model_name = _model_name(inner)
+        # One connection shared by every thread (e.g. query_cache.batch_query's
+        # workers); the lock makes sure only one thread uses it at a time
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB)"
+        )
+
+    def _hash(self, text):
+        key = f"{self._model_name}\0{text}".encode("utf-8")
+        return hashlib.blake2b(key, digest_size=16).digest()
+
+    def __call__(self, input):
+        texts = list(input)
+        if not texts:
+            return []
+        hashes = [self._hash(text) for text in texts]
+
+        # 1. Look up every text we already have a vector for
+        placeholders = ",".join("?" * len(hashes))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})",
+                hashes
+            ).fetchall()
+        vectors = {h: np.frombuffer(vec, dtype=np.float32) for h, vec in rows}
+
+        # 2. Embed only the texts we haven't seen, then save them for next time
+        misses = [i for i, h in enumerate(hashes) if h not in vectors]
+        if misses:
+            new_vectors = self._inner([texts[i] for i in misses])
+            with self._lock, self._conn:
+                for i, vector in zip(misses, new_vectors):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    vectors[hashes[i]] = vector
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)",
+                        (hashes[i], vector.tobytes())
+                    )
+
+        # Return float32 numpy rows instead of Python lists of floats:
+        # half the memory, and ChromaDB's search index works in float32 anyway
+        matrix = np.stack([vectors[h] for h in hashes]).astype(np.float32, copy=False)
+        return list(matrix)
+
+
+# The OpenAI embedding function is cached per (model, API key).
+# We only keep a hash of the key in the cache so the key itself isn't stored twice.
+_openai_efs = {}
+
+
+def get_openai_ef(model_name, api_key):
+    api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    cache_key = (model_name, api_key_hash)
+    if cache_key not in _openai_efs:
+        _openai_efs[cache_key] = AsyncOpenAIEmbeddingFunction(
+            model_name=model_name,
+            api_key=api_key
+        )
+    return _openai_efs[cache_key]
@@ -0,0 +1,28 @@
+# Compiled PDX Distance Kernel
+# ============================
+# Only used by SmallIndex(..., kernel="pdx") in vector_search.py.
+# It lives in its own file so that numba (pip install numba), which takes a
+# while to import, is only loaded when someone actually asks for it.
+
+import numpy as np
+from numba import njit, prange
+
+
+# Inner products of every query with every document in a PDX layout
+# (see vector_search.to_pdx). The innermost loop runs over 64 documents for
+# ONE query value, which the compiler turns into a few wide SIMD multiply-adds.
+# cache=True saves the compiled code to disk, so only the very first run
+# pays the couple of seconds it takes to compile.
+@njit(parallel=True, fastmath=True, cache=True)
+def pdx_inner(blocks, queries):
+    n_blocks, dims, width = blocks.shape
+    scores = np.zeros((queries.shape[0], n_blocks * width), dtype=np.float32)
+    for b in prange(n_blocks):
+        for q in range(queries.shape[0]):
+            acc = np.zeros(width, dtype=np.float32)
+            for d in range(dims):
+                q_d = queries[q, d]
+                for lane in range(width):
+                    acc[lane] += q_d * blocks[b, d, lane]
+            scores[q, b * width:(b + 1) * width] = acc
+    return scores
@@ -0,0 +1,113 @@
+# Query Result Cache
+# ==================
+# Asking the same question twice normally means embedding it and searching
+# the index twice. cached_query() remembers recent answers, so a repeated
+# question is answered straight from memory - like a help desk keeping a
+# list of frequently asked questions next to the phone.
+#
+# The cache key includes a "version" number per collection. Call
+# invalidate(collection) after you add, update or delete documents; the
+# version goes up and old answers for that collection are never used again.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueryCache:
+    def __init__(self, maxsize=10_000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl  # seconds an answer stays valid (None = until invalidated)
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def _key(self, collection, query_texts, n_results):
+        return (
+            collection.name,
+            self._versions.get(collection.name, 0),
+            tuple(query_texts),
+            n_results
+        )
+
+    # Returns the cached answer, or None if we don't have a fresh one
+    def get(self, collection, query_texts, n_results=1):
+        with self._lock:
+            key = self._key(collection, query_texts, n_results)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)  # mark as recently used
+            return result
+
+    # Pass `embeddings` if the questions are already embedded; they are still
+    # cached under their text, but ChromaDB doesn't embed them again.
+    def query(self, collection, query_texts, n_results=1, embeddings=None):
+        result = self.get(collection, query_texts, n_results)
+        if result is not None:
+            return result
+
+        # Not cached: run the real query (outside the lock so other threads
+        # aren't kept waiting), then remember the answer
+        with self._lock:
+            key = self._key(collection, query_texts, n_results)
+        if embeddings is None:
+            result = collection.query(query_texts=list(query_texts), n_results=n_results)
+        else:
+            result = collection.query(query_embeddings=list(embeddings), n_results=n_results)
+
+        with self._lock:
+            self._entries[key] = (result, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)  # drop the least recently used
+        return result
+
+    def invalidate(self, collection):
+        with self._lock:
+            self._versions[collection.name] = self._versions.get(collection.name, 0) + 1
+
+
+# One shared cache for the whole program
+_CACHE = QueryCache()
+
+
+def cached_query(collection, query_texts, n_results=1):
+    return _CACHE.query(collection, query_texts, n_results)
+
+
+def invalidate(collection):
+    _CACHE.invalidate(collection)
+
+
+# Worker threads for batch_query(). ChromaDB's search runs in compiled code
+# that lets other Python threads keep working, so several questions can
+# really be searched at the same time.
+_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+# Ask many questions at once; returns one result per question, in order.
+# Questions we already have answers for are answered right away. The new
+# ones are embedded together in ONE call here on the calling thread (many
+# embedding functions can't be shared between threads), and only the
+# finished vectors are handed to the worker threads for searching.
+def batch_query(collection, texts, n_results=1):
+    results = [_CACHE.get(collection, [text], n_results) for text in texts]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+    vectors = collection._embedding_function([texts[i] for i in misses])
+    answers = _POOL.map(
+        lambda i, vector: _CACHE.query(collection, [texts[i]], n_results, embeddings=[vector]),
+        misses,
+        vectors
+    )
+    for i, answer in zip(misses, answers):
+        results[i] = answer
+    return results
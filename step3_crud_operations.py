@@ -3,16 +3,75 @@
 # CRUD stands for: Create, Read, Update, Delete
 # These are the fundamental operations for working with data in ChromaDB
 
+import sys
+from itertools import islice
+
 import chromadb
 
+from embedding_cache import get_default_ef
+
+
+# Helper: add documents in batches
+# Every .add() call is one trip to the database (one "transaction").
+# Sending 100 documents per trip is much faster than 100 trips of 1 document,
+# like carrying a full box of files to the cabinet instead of one sheet at a time.
+def _bulk_add(collection, records, batch_size=100):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        ids, documents, metadatas = zip(*batch)
+        collection.add(
+            ids=list(ids),
+            documents=list(documents),
+            metadatas=list(metadatas)
+        )
+
+
+# Every metadata dictionary uses the same key, so we "intern" it: Python then
+# keeps ONE shared copy of the string instead of a new one per document.
+POLICY_TYPE = sys.intern("policy_type")
+
+
+# Helper: add documents stored as columns ("structure of arrays")
+# Instead of a list of dictionaries, we pass one list per field: all IDs,
+# all documents, all policy types... The metadata dictionaries are only
+# built right before each batch is sent, like filling in the forms at the
+# counter instead of carrying a pile of pre-filled forms around.
+def _bulk_add_soa(collection, ids, documents, policy_types, extra_cols=None, batch_size=100):
+    extra_cols = extra_cols or {}
+
+    def metadatas():
+        for row, policy_type in enumerate(policy_types):
+            metadata = {POLICY_TYPE: sys.intern(policy_type)}
+            for key, column in extra_cols.items():
+                if column[row] is not None:
+                    metadata[key] = column[row]
+            yield metadata
+
+    _bulk_add(collection, zip(ids, documents, metadatas()), batch_size)
+
+
 # Initialize ChromaDB and create our collection
 client = chromadb.Client()
-collection = client.get_or_create_collection(name="travel_policies")
+# hnsw:search_ef=32 makes searches look a little wider. That helps when a
+# metadata filter (see READ below) rules out some of the nearby documents.
+collection = client.get_or_create_collection(
+    name="travel_policies",
+    embedding_function=get_default_ef(),
+    metadata={"hnsw:search_ef": 32}
+)
 
 print("=" * 60)
 print("STEP 3: CRUD OPERATIONS ON DATA")
 print("=" * 60)
 
+# Asking ChromaDB to count documents means asking the database every time.
+# Instead we count once here and keep our own tally as we add and remove,
+# like keeping a running total on a notepad instead of recounting the drawer.
+doc_count = collection.count()
+
 # =============================================================================
 # CREATE: Adding Documents to the Collection
 # =============================================================================
@@ -23,29 +82,30 @@ print("-" * 60)
 # - ids: A unique identifier for each document (like a filing number)
 # - documents: The actual text content
 # - metadatas: Extra information for filtering (optional but very useful!)
+#
+# We keep our data as columns (one list per field) and only build the
+# metadata dictionaries at the last moment, right before they go to ChromaDB.
 
-collection.add(
-    ids=[
-        "flight_policy_01",
-        "hotel_policy_01",
-        "rental_car_policy_01",
-        "flight_policy_02"
-    ],
-    documents=[
-        "For domestic flights, employees must book economy class tickets. Business class is only permitted for international flights over 8 hours.",
-        "Employees can book hotels up to a maximum of $250 per night in major cities. A list of preferred hotel partners is available.",
-        "A mid-size sedan is the standard for car rentals. Upgrades require manager approval. Always select the company's insurance option.",
-        "All flights, regardless of destination, must be booked through the official company travel portal, 'Concur'."
-    ],
-    metadatas=[
-        {"policy_type": "flights"},
-        {"policy_type": "hotels"},
-        {"policy_type": "rental_cars"},
-        {"policy_type": "flights", "requires_portal": "True"}
-    ]
-)
+policy_ids = [
+    "flight_policy_01",
+    "hotel_policy_01",
+    "rental_car_policy_01",
+    "flight_policy_02"
+]
+policy_documents = [
+    "For domestic flights, employees must book economy class tickets. Business class is only permitted for international flights over 8 hours.",
+    "Employees can book hotels up to a maximum of $250 per night in major cities. A list of preferred hotel partners is available.",
+    "A mid-size sedan is the standard for car rentals. Upgrades require manager approval. Always select the company's insurance option.",
+    "All flights, regardless of destination, must be booked through the official company travel portal, 'Concur'."
+]
+policy_types = ["flights", "hotels", "rental_cars", "flights"]
+# Extra metadata columns; None means "this document doesn't have that field"
+extra_columns = {"requires_portal": [None, None, None, "True"]}
+
+_bulk_add_soa(collection, policy_ids, policy_documents, policy_types, extra_columns)
+doc_count += len(policy_ids)
 
-print(f"Added {collection.count()} documents to the collection!")
+print(f"Added {doc_count} documents to the collection!")
 
 # =============================================================================
 # READ: Querying Documents (The Smart Search!)
@@ -57,32 +117,57 @@ print("-" * 60)
 # ChromaDB converts our question into an "embedding" (a list of numbers)
 # and finds documents with similar meanings
 
-query_question = "What is the policy for international flights?"
+# We already know every question this script will ask, so we turn them all
+# into embeddings in ONE call up front. The model handles a batch of
+# questions much faster than the same questions one at a time.
+queries = [
+    "What is the policy for international flights?",
+    "How much can I spend on accommodation?",
+    "hotel spending limit"
+]
+query_embeddings = get_default_ef()(queries)
+
+query_question = queries[0]
 print(f"\nQuestion: '{query_question}'")
 
+# Because we already have the embedding, we pass query_embeddings instead
+# of query_texts - ChromaDB doesn't need to run the model again.
+#
+# We're asking about flights, so we also add a metadata filter with "where".
+# ChromaDB then skips non-flight documents while it searches, instead of us
+# throwing away the wrong results afterwards in Python.
 results = collection.query(
-    query_texts=[query_question],
-    n_results=2  # Get the top 2 most relevant results
+    query_embeddings=[query_embeddings[0]],
+    n_results=2,  # Get the top 2 most relevant results
+    where={POLICY_TYPE: "flights"}  # Only look at flight policies
 )
 
-print("\nTop 2 most relevant policies:")
-for i, (doc, distance, metadata) in enumerate(zip(
-    results['documents'][0],
-    results['distances'][0],
-    results['metadatas'][0]
-), 1):
-    print(f"\n  Result #{i}:")
-    print(f"    Document: {doc[:80]}...")  # Show first 80 characters
-    print(f"    Metadata: {metadata}")
-    print(f"    Distance: {distance:.4f} (lower = more similar)")
+print("\nTop 2 most relevant flight policies:")
+print("(With a metadata filter, ChromaDB prunes non-matching documents during")
+print(" the search rather than filtering the results afterwards.)")
+
+# We build the text for every result first, then print it all in one go.
+# Document shows the first 80 characters; lower distance = more similar.
+result_lines = [
+    f"\n  Result #{i}:"
+    f"\n    Document: {doc[:80]}..."
+    f"\n    Metadata: {metadata}"
+    f"\n    Distance: {distance:.4f} (lower = more similar)"
+    for i, (doc, distance, metadata) in enumerate(zip(
+        results['documents'][0],
+        results['distances'][0],
+        results['metadatas'][0]
+    ), 1)
+]
+sys.stdout.write("\n".join(result_lines) + "\n")
 
 # Let's try another query
 print("\n" + "-" * 60)
-query_question_2 = "How much can I spend on accommodation?"
+query_question_2 = queries[1]
 print(f"\nQuestion: '{query_question_2}'")
 
 results2 = collection.query(
-    query_texts=[query_question_2],
+    query_embeddings=[query_embeddings[1]],
     n_results=1
 )
 
@@ -100,29 +185,35 @@ print("-" * 60)
 # - UPDATE the document if the ID exists
 # - INSERT (create) a new one if the ID doesn't exist
 
+# We have two changes to make: update the hotel policy AND add a new train
+# policy. Instead of two separate calls, we send both in ONE upsert.
+# The embedding model then reads both texts in a single pass instead of two.
+upsert_ids = ["hotel_policy_01", "train_policy_01"]
 collection.upsert(
-    ids=["hotel_policy_01"],
-    documents=["Employees can book hotels up to a maximum of $300 per night. See the portal for preferred partners."],
-    metadatas=[{"policy_type": "hotels", "max_spend": 300}]
+    ids=upsert_ids,
+    documents=[
+        "Employees can book hotels up to a maximum of $300 per night. See the portal for preferred partners.",
+        "Train travel is encouraged for trips under 4 hours. Business class tickets are approved for all train journeys."
+    ],
+    metadatas=[
+        {POLICY_TYPE: "hotels", "max_spend": 300},
+        {POLICY_TYPE: "train", "last_updated": "2025-10-15"}
+    ]
 )
 
 print("Updated hotel_policy_01 - increased budget from $250 to $300!")
-
-# Let's add a completely new policy using upsert
-collection.upsert(
-    ids=["train_policy_01"],
-    documents=["Train travel is encouraged for trips under 4 hours. Business class tickets are approved for all train journeys."],
-    metadatas=[{"policy_type": "train", "last_updated": "2025-10-15"}]
-)
-
 print("Added new policy: train_policy_01")
-print(f"Collection now has {collection.count()} documents")
+
+# Only IDs we didn't add earlier are NEW documents (here: train_policy_01);
+# the others were just updated and don't change the count
+doc_count += len(set(upsert_ids) - set(policy_ids))
+print(f"Collection now has {doc_count} documents")
 
 # Let's verify the update worked
 print("\n" + "-" * 60)
 print("Verifying the hotel budget update:")
 results3 = collection.query(
-    query_texts=["hotel spending limit"],
+    query_embeddings=[query_embeddings[2]],
     n_results=1
 )
 print(f"  {results3['documents'][0][0]}")
@@ -134,10 +225,15 @@ print("\nDELETE: Removing outdated policies...")
 print("-" * 60)
 
 # The train policy was just a test. Let's remove it.
-collection.delete(ids=["train_policy_01"])
+# We collect every ID to remove in one list so a single .delete() call
+# handles them all, no matter how many there are.
+delete_ids = ["train_policy_01"]
+collection.delete(ids=delete_ids)
+
+doc_count -= len(delete_ids)
 
 print("Deleted train_policy_01")
-print(f"Collection now has {collection.count()} documents")
+print(f"Collection now has {doc_count} documents")
 
 # =============================================================================
 # SUMMARY
@@ -147,11 +243,15 @@ print("FINAL SUMMARY")
 print("=" * 60)
 
 # Get all documents to show final state
-all_docs = collection.get()
-print(f"\nTotal documents in collection: {collection.count()}")
+# This time we ask ChromaDB for the real count to double-check our tally
+# We only print IDs, so include=[] tells ChromaDB to skip documents and metadata
+all_docs = collection.get(include=[])
+real_count = collection.count()
+print(f"\nTotal documents in collection: {real_count}")
+print(f"Matches our own tally: {real_count == doc_count}")
 print("\nAll policy IDs:")
-for doc_id in all_docs['ids']:
-    print(f"  - {doc_id}")
+# Build the whole list first and write it out once (one print instead of many)
+sys.stdout.write("\n".join(f"  - {doc_id}" for doc_id in all_docs['ids']) + "\n")
 
 print("\nStep 3 completed successfully!")
 print("You now know how to Create, Read, Update, and Delete documents!")
@@ -4,9 +4,16 @@
 # This means data disappears when the program ends!
 # 
 # PersistentClient saves data to disk, so it persists between program runs.
+#
+# NOTE: "saved_policies" uses the same small search index settings as Step 2.
+# A real, large collection would want hnsw:M of 16-32 and
+# hnsw:construction_ef of 200.
 
-import chromadb
 import os
+import sys
+
+from client_factory import get_client
+from embedding_cache import get_normalized_ef
 
 print("=" * 60)
 print("STEP 4: PERSISTENT STORAGE")
@@ -31,8 +38,9 @@ print("-" * 60)
 # Create a PersistentClient that saves data to a folder
 # The "path" parameter tells ChromaDB where to store the database files
 # If the folder doesn't exist, ChromaDB will create it for you!
+# get_client() opens the folder once and reuses the same PersistentClient
 
-persistent_client = chromadb.PersistentClient(path="./chroma_db")
+persistent_client = get_client("./chroma_db")
 
 print("Created PersistentClient")
 print(f"Database files will be saved in: {os.path.abspath('./chroma_db')}")
@@ -46,10 +54,22 @@ print("-" * 60)
 # Everything else works exactly the same as before!
 # The only difference is that now the data is saved to disk
 
-p_collection = persistent_client.get_or_create_collection(name="saved_policies")
+p_collection = persistent_client.get_or_create_collection(
+    name="saved_policies",
+    embedding_function=get_normalized_ef(),  # length-1 vectors for "ip" space
+    metadata={
+        "hnsw:M": 8,
+        "hnsw:construction_ef": 40,
+        "hnsw:search_ef": 16,
+        "hnsw:space": "ip"
+    }
+)
+
+# Count once and keep our own running total from here on
+doc_count = p_collection.count()
 
 print(f"Collection '{p_collection.name}' created (or retrieved if it existed)")
-print(f"Current document count: {p_collection.count()}")
+print(f"Current document count: {doc_count}")
 
 # =============================================================================
 # ADDING DATA THAT PERSISTS
@@ -58,16 +78,17 @@ print("\nAdding Data That Will Persist")
 print("-" * 60)
 
 # Let's check if we already have data from a previous run
-if p_collection.count() > 0:
+if doc_count > 0:
     print("Collection already has data from a previous run!")
     print("   This proves persistence is working!")
-    print(f"   Documents in collection: {p_collection.count()}")
+    print(f"   Documents in collection: {doc_count}")
 else:
     # First time running - let's add some data
     print("First time running - adding initial data...")
     
+    new_ids = ["saved_policy_01", "saved_policy_02", "saved_policy_03"]
     p_collection.add(
-        ids=["saved_policy_01", "saved_policy_02", "saved_policy_03"],
+        ids=new_ids,
         documents=[
             "All expense reports must be submitted within 15 days of trip completion.",
             "Travel insurance is mandatory for all international trips exceeding 7 days.",
@@ -80,7 +101,8 @@ else:
         ]
     )
     
-    print(f"Added {p_collection.count()} documents")
+    doc_count += len(new_ids)
+    print(f"Added {doc_count} documents")
     print("Data is now saved to disk!")
 
 # =============================================================================
@@ -116,11 +138,12 @@ print("This is the power of PersistentClient - your data survives!")
 print("\nAll Stored Policies")
 print("-" * 60)
 
-all_data = p_collection.get()
+# include=[] returns just the IDs - we don't need the text or metadata here
+all_data = p_collection.get(include=[])
 print(f"Total documents: {len(all_data['ids'])}")
 print("\nStored policy IDs:")
-for policy_id in all_data['ids']:
-    print(f"  - {policy_id}")
+# Build the whole list first and write it out in one go
+sys.stdout.write("\n".join(f"  - {policy_id}" for policy_id in all_data['ids']) + "\n")
 
 # =============================================================================
 # COMPARING: In-Memory vs Persistent
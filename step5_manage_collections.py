@@ -2,15 +2,57 @@
 # ====================================================
 # In Step 3, we learned CRUD on DOCUMENTS (the data inside collections)
 # Now we'll learn CRUD on COLLECTIONS themselves (the containers)
+#
+# NOTE: SMALL_INDEX below keeps the search index light for tiny collections.
+# Bigger collections should raise hnsw:M to 16-32 and hnsw:construction_ef to 200.
+
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from client_factory import get_client
+from embedding_cache import get_normalized_ef
+
+
+# Helper: take a "snapshot" of every collection, keyed by name
+# list_collections() asks the database every time, so we call it once and
+# then keep the snapshot up to date ourselves when we rename or delete a
+# collection - like reading the drawer labels once and relabelling your notes
+# instead of walking over to the cabinet every time.
+def _snapshot(client):
+    return {c.name: c for c in client.list_collections()}
+
+
+# Helper: count the documents in EVERY collection with one database query
+# Calling coll.count() in a loop asks the database once per collection.
+# Here we ask once for all of them ("GROUP BY" = one total per collection),
+# reading ChromaDB's database file directly. "mode=ro" opens it read-only,
+# so we can't change anything by accident. If the file or its tables look
+# different in your ChromaDB version we return None and use coll.count().
+def _count_all(path):
+    try:
+        conn = sqlite3.connect(f"file:{path}/chroma.sqlite3?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT segments.collection, COUNT(*) FROM embeddings "
+                "JOIN segments ON embeddings.segment_id = segments.id "
+                "GROUP BY segments.collection"
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return {collection_id: count for collection_id, count in rows}
 
-import chromadb
 
 print("=" * 60)
 print("STEP 5: CRUD OPERATIONS ON COLLECTIONS")
 print("=" * 60)
 
 # Let's use PersistentClient so our collections persist
-client = chromadb.PersistentClient(path="./chroma_db")
+# get_client() opens the folder once and reuses the same PersistentClient
+DB_PATH = "./chroma_db"
+client = get_client(DB_PATH)
 
 # =============================================================================
 # CREATE: Creating Multiple Collections
@@ -20,21 +62,36 @@ print("-" * 60)
 
 # Let's create several collections for different purposes
 # Think of these as different filing cabinet drawers
-
-travel_collection = client.get_or_create_collection(
-    name="travel_policies",
-    metadata={"department": "HR", "category": "policies"}
-)
-
-hr_collection = client.get_or_create_collection(
-    name="hr_policies", 
-    metadata={"department": "HR", "category": "employment"}
-)
-
-it_collection = client.get_or_create_collection(
-    name="it_policies",
-    metadata={"department": "IT", "category": "security"}
-)
+# Each one also gets the small-collection search index settings, and
+# get_normalized_ef() scales vectors to length 1 so "ip" ranks like cosine
+SMALL_INDEX = {"hnsw:M": 8, "hnsw:construction_ef": 40, "hnsw:search_ef": 16, "hnsw:space": "ip"}
+
+collection_specs = [
+    {
+        "name": "travel_policies",
+        "metadata": {"department": "HR", "category": "policies", **SMALL_INDEX},
+        "embedding_function": get_normalized_ef()
+    },
+    {
+        "name": "hr_policies",
+        "metadata": {"department": "HR", "category": "employment", **SMALL_INDEX},
+        "embedding_function": get_normalized_ef()
+    },
+    {
+        "name": "it_policies",
+        "metadata": {"department": "IT", "category": "security", **SMALL_INDEX},
+        "embedding_function": get_normalized_ef()
+    }
+]
+
+# The three collections don't depend on each other, so we create them at the
+# same time with a small pool of worker threads - like three clerks each
+# setting up a drawer instead of one clerk doing all three in a row.
+with ThreadPoolExecutor(max_workers=3) as pool:
+    travel_collection, hr_collection, it_collection = pool.map(
+        lambda spec: client.get_or_create_collection(**spec),
+        collection_specs
+    )
 
 print("Created/Retrieved 3 collections:")
 print(f"  - {travel_collection.name}")
@@ -48,16 +105,30 @@ print("\nREAD: Listing All Collections")
 print("-" * 60)
 
 # Get all collections in the database
-all_collections = client.list_collections()
+snapshot = _snapshot(client)
+all_collections = list(snapshot.values())
 
 print(f"Total collections in database: {len(all_collections)}")
 print("\nCollection Details:")
 
+counts = _count_all(DB_PATH)
+
+# If the single query isn't available, count each collection instead -
+# but in parallel threads, so we aren't waiting on them one by one
+if counts is None:
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        counts = dict(zip(
+            (str(coll.id) for coll in all_collections),
+            pool.map(lambda coll: coll.count(), all_collections)
+        ))
+
 for coll in all_collections:
+    # Empty collections don't show up in the GROUP BY, so they count as 0
+    doc_count = counts.get(str(coll.id), 0)
     print(f"\n  Collection: {coll.name}")
     print(f"    ID: {coll.id}")
     print(f"    Metadata: {coll.metadata}")
-    print(f"    Document Count: {coll.count()}")
+    print(f"    Document Count: {doc_count}")
 
 # =============================================================================
 # Retrieving a Specific Collection
@@ -99,11 +170,14 @@ print(f"  Old name: it_policies")
 print(f"  New name: it_security_policies")
 print(f"  New metadata: {it_collection.metadata}")
 
-# Let's verify by listing collections again
+# We know exactly what changed, so we update our snapshot directly
+# instead of asking the database for the whole list again
+snapshot.pop("it_policies", None)
+snapshot[it_collection.name] = it_collection
 print("\nUpdated Collection List:")
-updated_collections = client.list_collections()
-for coll in updated_collections:
-    print(f"  - {coll.name} (metadata: {coll.metadata})")
+sys.stdout.write("\n".join(
+    f"  - {coll.name} (metadata: {coll.metadata})" for coll in snapshot.values()
+) + "\n")
 
 # =============================================================================
 # DELETE: Removing Collections
@@ -111,19 +185,21 @@ for coll in updated_collections:
 print("\nDELETE: Removing Collections")
 print("-" * 60)
 
-print(f"Collections before deletion: {len(client.list_collections())}")
+print(f"Collections before deletion: {len(snapshot)}")
 
 # Let's delete the HR policies collection
 # WARNING: This will permanently delete the collection AND all its data!
 client.delete_collection(name="hr_policies")
 
+snapshot.pop("hr_policies", None)
+
 print("Deleted 'hr_policies' collection")
-print(f"Collections after deletion: {len(client.list_collections())}")
+print(f"Collections after deletion: {len(snapshot)}")
 
 # List remaining collections
 print("\nRemaining Collections:")
-for coll in client.list_collections():
-    print(f"  - {coll.name}")
+# One write for the whole list instead of one print per collection
+sys.stdout.write("\n".join(f"  - {coll.name}" for coll in snapshot.values()) + "\n")
 
 # =============================================================================
 # BEST PRACTICES
@@ -169,16 +245,16 @@ print("=" * 60)
 
 # 1. Check if collection exists
 collection_name = "temporary_test_collection"
-existing_collections = [c.name for c in client.list_collections()]
 
-if collection_name in existing_collections:
+if collection_name in snapshot:
     print(f"Collection '{collection_name}' already exists")
     test_coll = client.get_collection(collection_name)
 else:
     print(f"Creating new collection '{collection_name}'")
     test_coll = client.create_collection(
         name=collection_name,
-        metadata={"purpose": "testing", "temporary": True}
+        metadata={"purpose": "testing", "temporary": True},
+        embedding_function=get_normalized_ef()
     )
 
 # 2. Add some data
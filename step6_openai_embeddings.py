@@ -5,9 +5,55 @@
 # 
 # This step shows how to integrate OpenAI embeddings for even better results.
 
-import chromadb
-from chromadb.utils import embedding_functions
 import os
+import textwrap
+from functools import cache, lru_cache
+
+import numpy as np
+
+from client_factory import get_client
+from embedding_cache import CachedEmbeddingFunction, get_fp16_ef, get_normalized_ef, get_openai_ef
+from query_cache import cached_query, invalidate
+from vector_search import SmallIndex, query_one
+
+# The question(s) we ask BOTH collections in the demonstration at the end.
+# One shared list means we can pass every question in a single .query() call.
+QUERY_TEXTS = ["accommodation spending limits"]
+
+
+# Loading a tiktoken encoding reads its vocabulary from disk.
+# lru_cache makes sure we only do that once, however often we ask for it.
+@lru_cache(maxsize=None)
+def get_encoding(name="cl100k_base"):
+    import tiktoken
+
+    return tiktoken.get_encoding(name)
+
+
+# Query embeddings, remembered per model and per question text:
+# _QUERY_CACHE["model name"]["question"] -> vector
+# Each model turns each question into a vector only once, however many
+# times (or against however many collections) we ask it.
+_QUERY_CACHE = {}
+
+
+def embed_queries(model_name, ef, texts):
+    cache = _QUERY_CACHE.setdefault(model_name, {})
+    missing = [text for text in texts if text not in cache]
+    if missing:
+        cache.update(zip(missing, ef(missing)))
+    return [cache[text] for text in texts]
+
+
+# The distance type a collection was created with: "l2" (ChromaDB's
+# default), "ip" or "cosine"
+def _distance_space(collection):
+    metadata = collection.metadata or {}
+    if "hnsw:space" in metadata:
+        return metadata["hnsw:space"]
+    hnsw = (getattr(collection, "configuration", None) or {}).get("hnsw") or {}
+    return hnsw.get("space") or "l2"
+
 
 print("=" * 70)
 print("STEP 6: ADVANCED - USING OPENAI'S EMBEDDING MODEL")
@@ -81,41 +127,82 @@ else:
 print("\nCreating Collection with OpenAI Embeddings")
 print("-" * 70)
 
-client = chromadb.PersistentClient(path="./chroma_db")
+# get_client() reuses the PersistentClient from earlier steps if it is already open
+client = get_client("./chroma_db")
+
+# The policies we'll store - used for both the OpenAI and the default collection
+policy_ids = ["flight_01", "hotel_01", "expense_01"]
+policy_documents = [
+    "For domestic flights, employees must book economy class tickets. Business class is only permitted for international flights over 8 hours.",
+    "Employees can book hotels up to a maximum of $300 per night. See the portal for preferred partners.",
+    "All expenses must be submitted within 15 days with receipts for items over $25."
+]
+
+# Policy types are stored as small numbers instead of text. Comparing
+# numbers is cheaper than comparing strings when ChromaDB filters with
+# where={"policy_type": ...}, and they take less space on disk.
+# POLICY_TYPE_NAMES turns the numbers back into words for display.
+POLICY_TYPE_CODES = {"flights": 0, "hotels": 1, "expenses": 2}
+POLICY_TYPE_NAMES = {code: name for name, code in POLICY_TYPE_CODES.items()}
+
+policy_metadatas = [
+    {"policy_type": POLICY_TYPE_CODES["flights"]},
+    {"policy_type": POLICY_TYPE_CODES["hotels"]},
+    {"policy_type": POLICY_TYPE_CODES["expenses"]}
+]
+
+
+# get_openai_ef() reuses the same embedding function if we ask again,
+# and sends its requests to OpenAI in parallel batches
+# CachedEmbeddingFunction saves every vector to ./emb_cache.sqlite,
+# so running this script again doesn't pay OpenAI for the same texts
+@cache
+def get_cached_openai_ef():
+    return CachedEmbeddingFunction(
+        get_openai_ef(
+            model_name="text-embedding-3-small",  # OpenAI's efficient model
+            api_key=openai_api_key
+        ),
+        cache_path="./emb_cache.sqlite"
+    )
+
+
+# Build the OpenAI collection only when we actually need it.
+# @cache means the work (and the calls to OpenAI) happens the FIRST time this
+# is called; every later call just hands back the same collection.
+@cache
+def get_openai_collection():
+    print("Setting up OpenAI embedding function...")
+    openai_ef = get_cached_openai_ef()
+    
+    # Create a collection with OpenAI embeddings
+    collection = client.get_or_create_collection(
+        name="travel_policies_openai",
+        embedding_function=openai_ef
+    )
+    
+    print("Created collection with OpenAI embeddings!")
+    
+    # Add some documents
+    print("\nAdding documents...")
+    # All three documents go to OpenAI in ONE request (not one per document),
+    # and we hand the vectors to ChromaDB so it doesn't embed them again.
+    # upsert() (from Step 3) also refreshes documents saved by an earlier run.
+    collection.upsert(
+        ids=policy_ids,
+        documents=policy_documents,
+        embeddings=openai_ef(policy_documents),
+        metadatas=policy_metadatas
+    )
+    # The documents changed, so forget any cached answers for this collection
+    invalidate(collection)
+    return collection
+
 
 if openai_api_key:
     # If we have an API key, use OpenAI embeddings
     try:
-        print("Setting up OpenAI embedding function...")
-        
-        openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-            model_name="text-embedding-3-small",  # OpenAI's efficient model
-            api_key=openai_api_key
-        )
-        
-        # Create a collection with OpenAI embeddings
-        openai_collection = client.get_or_create_collection(
-            name="travel_policies_openai",
-            embedding_function=openai_ef
-        )
-        
-        print("Created collection with OpenAI embeddings!")
-        
-        # Add some documents
-        print("\nAdding documents...")
-        openai_collection.add(
-            ids=["flight_01", "hotel_01", "expense_01"],
-            documents=[
-                "For domestic flights, employees must book economy class tickets. Business class is only permitted for international flights over 8 hours.",
-                "Employees can book hotels up to a maximum of $300 per night. See the portal for preferred partners.",
-                "All expenses must be submitted within 15 days with receipts for items over $25."
-            ],
-            metadatas=[
-                {"policy_type": "flights"},
-                {"policy_type": "hotels"},
-                {"policy_type": "expenses"}
-            ]
-        )
+        openai_collection = get_openai_collection()
         
         print(f"Added {openai_collection.count()} documents with OpenAI embeddings")
         
@@ -123,13 +210,16 @@ if openai_api_key:
         print("\nQuerying with OpenAI Embeddings")
         print("-" * 70)
         
-        query_result = openai_collection.query(
-            query_texts=["What's the hotel spending limit?"],
+        # cached_query() remembers the answer, so asking again is instant
+        query_result = cached_query(
+            openai_collection,
+            ["What's the hotel spending limit?"],
             n_results=1
         )
         
         print("Question: 'What's the hotel spending limit?'")
         print(f"\nAnswer: {query_result['documents'][0][0]}")
+        print(f"Policy type: {POLICY_TYPE_NAMES[query_result['metadatas'][0][0]['policy_type']]}")
         print(f"Distance: {query_result['distances'][0][0]:.4f}")
         
         print("\nOpenAI embeddings are working!")
@@ -154,13 +244,12 @@ if openai_api_key:
     print("-" * 70)
     
     try:
-        import tiktoken
-        
         # OpenAI's text-embedding-3-small uses cl100k_base encoding
-        encoding = tiktoken.get_encoding("cl100k_base")
+        encoding = get_encoding("cl100k_base")
         
+        # encode_ordinary() skips special-token handling we don't need here
         sample_text = "All expense reports must be submitted within 15 days."
-        tokens = encoding.encode(sample_text)
+        tokens = encoding.encode_ordinary(sample_text)
         token_count = len(tokens)
         
         print(f"Sample text: '{sample_text}'")
@@ -177,6 +266,19 @@ if openai_api_key:
         print(f"  - 1,000 similar texts: ${cost_for_sample * 1000:.6f}")
         print(f"  - Very affordable for most use cases!")
         
+        # For many texts, encode_ordinary_batch() counts tokens for all of
+        # them at once, using every CPU core
+        batch_tokens = encoding.encode_ordinary_batch(
+            policy_documents,
+            num_threads=os.cpu_count()
+        )
+        token_counts = np.fromiter((len(t) for t in batch_tokens), dtype=np.int32)
+        total_cost = token_counts.sum() * cost_per_million / 1_000_000
+        
+        print(f"\nOur {len(policy_documents)} policy documents:")
+        print(f"  - Total tokens: {token_counts.sum()}")
+        print(f"  - Total cost: ${total_cost:.8f}")
+        
     except ImportError:
         print("tiktoken not installed")
         print("   Install with: pip install tiktoken")
@@ -223,43 +325,112 @@ print("=" * 70)
 print("DEMONSTRATION")
 print("=" * 70)
 
+# Optional: with CHROMA_FP16=1 we embed with a half-precision (FP16) copy of
+# the default model, which is quicker to run (see get_fp16_ef()). If that
+# copy can't be made or loaded, we simply keep the normal model.
+minilm_ef = get_normalized_ef()
+if os.environ.get("CHROMA_FP16") == "1":
+    try:
+        minilm_ef = get_fp16_ef()
+        print("Using the FP16 copy of the default model")
+    except Exception as e:
+        print(f"FP16 model not available ({e}) - using the normal default model")
+
 # Create a collection with default embeddings for comparison
+# These search index settings are the usual starting point once a collection
+# grows beyond a toy example: more links per point (M) and more effort when
+# building/searching (construction_ef/search_ef) find the true nearest
+# documents more reliably, for a little extra build time and memory.
+# With just 3 documents every setting finds the right answer; the difference
+# only shows on bigger collections. We query this collection at the end.
+# Both versions of the model give every vector length 1, so inner product
+# ("ip") ranks exactly like cosine while skipping the per-search length maths.
 default_collection = client.get_or_create_collection(
-    name="travel_policies_default"
+    name="travel_policies_default",
+    embedding_function=minilm_ef,
+    metadata={
+        "hnsw:space": "ip",
+        "hnsw:M": 16,
+        "hnsw:construction_ef": 200,
+        "hnsw:search_ef": 50
+    }
 )
 
-if default_collection.count() == 0:
-    default_collection.add(
-        ids=["flight_01", "hotel_01", "expense_01"],
-        documents=[
-            "For domestic flights, employees must book economy class tickets. Business class is only permitted for international flights over 8 hours.",
-            "Employees can book hotels up to a maximum of $300 per night. See the portal for preferred partners.",
-            "All expenses must be submitted within 15 days with receipts for items over $25."
-        ],
-        metadatas=[
-            {"policy_type": "flights"},
-            {"policy_type": "hotels"},
-            {"policy_type": "expenses"}
-        ]
+# Embed our documents ONCE with the default model. We use these vectors
+# both to fill the ChromaDB collection and for the quick search below.
+# CachedEmbeddingFunction remembers every vector in ./emb_cache.sqlite, so on
+# a re-run nothing is re-embedded and the model doesn't even need to load.
+default_ef = CachedEmbeddingFunction(minilm_ef, cache_path="./emb_cache.sqlite")
+policy_embeddings = default_ef(policy_documents)
+
+# Each stored document also remembers which model embedded it. Never mix
+# models in one collection: if you switch CHROMA_FP16 on or off, every
+# document counts as changed and is re-embedded with the current model.
+embedding_model = getattr(minilm_ef, "model_name", "all-MiniLM-L6-v2")
+default_metadatas = [
+    {**metadata, "embedding_model": embedding_model} for metadata in policy_metadatas
+]
+
+# Only write documents that are missing or whose text, metadata or model has
+# changed since the last run - just checking count() would miss those cases
+stored = default_collection.get(ids=policy_ids, include=["documents", "metadatas"])
+stored_rows = dict(zip(stored['ids'], zip(stored['documents'], stored['metadatas'])))
+stale = [
+    i for i, row in enumerate(zip(policy_ids, policy_documents, default_metadatas))
+    if stored_rows.get(row[0]) != row[1:]
+]
+
+if stale:
+    default_collection.upsert(
+        ids=[policy_ids[i] for i in stale],
+        documents=[policy_documents[i] for i in stale],
+        embeddings=[policy_embeddings[i] for i in stale],
+        metadatas=[default_metadatas[i] for i in stale]
     )
 
 # Query with default model
+# With only 3 documents, comparing the question against all of them directly
+# (SmallIndex) is faster than going through ChromaDB's search index.
+# Distance here is cosine distance: 0 = same meaning, 2 = opposite.
+# textwrap.shorten() cuts long answers at a word boundary (max 70 characters)
+# and only adds "..." when something was actually cut off
 print("\nQuery with DEFAULT model:")
-default_result = default_collection.query(
-    query_texts=["accommodation spending limits"],
-    n_results=1
+default_index = SmallIndex(policy_documents, policy_embeddings, ids=policy_ids, metadatas=policy_metadatas)
+default_query_embeddings = embed_queries(embedding_model, default_ef, QUERY_TEXTS)
+default_best = default_index.search(default_query_embeddings, n_results=1)[0][0]
+print(f"Answer: {textwrap.shorten(default_best['doc'], width=70, placeholder='...')}")
+print(f"Distance: {default_best['dist']:.4f}")
+
+# The same question through ChromaDB's search index (the HNSW settings from
+# above). A collection keeps the distance type ("space") it was FIRST created
+# with. Created by this version it's "ip": 1 - similarity, the same number
+# SmallIndex printed. One saved by an older version of this script has no
+# "hnsw:space", so it uses ChromaDB's default "l2" (squared distance), which
+# for length-1 vectors is exactly 2x the cosine distance.
+chroma_answer, chroma_distance = query_one(
+    default_collection, QUERY_TEXTS[0], embedding=default_query_embeddings[0]
 )
-print(f"Answer: {default_result['documents'][0][0][:70]}...")
-print(f"Distance: {default_result['distances'][0][0]:.4f}")
+distance_space = _distance_space(default_collection)
+print(f"ChromaDB index agrees: {chroma_answer == default_best['doc']} "
+      f"({distance_space} distance {chroma_distance:.4f})")
+if distance_space == "l2":
+    print("  (this collection was created earlier with l2 distance: 2x the cosine distance)")
 
-if openai_api_key and 'openai_collection' in locals():
+if openai_api_key:
     print("\nQuery with OPENAI model:")
-    openai_result = openai_collection.query(
-        query_texts=["accommodation spending limits"],
-        n_results=1
+    # Already built above - @cache hands back the same collection
+    openai_collection = get_openai_collection()
+    # We pass the question as a ready-made vector, so ChromaDB doesn't call
+    # the embedding model again for it. query_one() asks for just the best
+    # match and hands back a simple (answer, distance) pair.
+    openai_query_embedding = embed_queries(
+        "text-embedding-3-small", get_cached_openai_ef(), QUERY_TEXTS
+    )[0]
+    openai_answer, openai_distance = query_one(
+        openai_collection, QUERY_TEXTS[0], embedding=openai_query_embedding
     )
-    print(f"Answer: {openai_result['documents'][0][0][:70]}...")
-    print(f"Distance: {openai_result['distances'][0][0]:.4f}")
+    print(f"Answer: {textwrap.shorten(openai_answer, width=70, placeholder='...')}")
+    print(f"Distance: {openai_distance:.4f}")
     
     print("\nBoth models found the correct answer!")
     print("   (OpenAI might have slightly different distance scores)")
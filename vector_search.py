@@ -0,0 +1,296 @@
+# Tiny In-Memory Vector Search
+# ============================
+# ChromaDB's search index (HNSW) is built for thousands or millions of
+# documents. For a handful of documents it's quicker to simply compare the
+# question against EVERY document - like reading three index cards instead
+# of looking them up in a library catalogue.
+#
+# SmallIndex keeps all document embeddings in one numpy array and does
+# exactly that. If the optional "simsimd" package is installed
+# (pip install simsimd) it uses its hand-tuned distance functions,
+# otherwise plain numpy does the same maths. With the optional "numba"
+# package (pip install numba) you can ask for a compiled PDX kernel instead
+# (kernel="pdx", see pdx_kernel.py), and with "cupy" and an NVIDIA GPU
+# really big indexes are searched on the GPU.
+
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# Documents per PDX block (see to_pdx below)
+PDX_BLOCK = 64
+
+# Below this many documents, copying data to the GPU costs more than it saves
+GPU_MIN_DOCS = 10_000
+
+# Documents per slice when the int8 codes are scanned without simsimd
+INT8_BLOCK = 4096
+
+
+# cupy, if it is installed AND can see a working NVIDIA GPU; otherwise None.
+# Importing cupy is slow, so we only try the first time a big index needs
+# it, and lru_cache remembers the answer.
+@lru_cache(maxsize=1)
+def _load_cupy():
+    try:
+        import cupy as cp
+
+        if cp.cuda.runtime.getDeviceCount() > 0:
+            return cp
+    except Exception:
+        pass  # not installed, no driver, no device... - search on the CPU
+    return None
+
+
+# Scale every row to length 1 so cosine distance is just 1 - (a · b)
+def normalize(vectors):
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+# Order documents so that similar ones sit next to each other in memory.
+# We group the (unit-length) embeddings into about sqrt(N) clusters with a
+# few rounds of k-means, then sort by cluster number - like shelving library
+# books by topic instead of by the date they arrived. Returns the new order
+# as positions, so ids/metadatas can be re-ordered the same way.
+def cluster_order(vectors, n_clusters=None, iterations=10, seed=0):
+    n = len(vectors)
+    n_clusters = n_clusters or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(n, size=n_clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignment == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    assignment = np.argmax(vectors @ centroids.T, axis=1)
+    return np.argsort(assignment, kind="stable")
+
+
+# An empty numpy array whose data starts on a 64-byte boundary.
+# CPUs read memory in 64-byte "cache lines"; when every embedding matrix
+# starts on a line boundary, wide SIMD loads never straddle two lines.
+def aligned_empty(shape, dtype=np.float32, align=64):
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + align, dtype=np.uint8)
+    offset = (-raw.ctypes.data) % align
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+# PDX layout: group documents into blocks of 64 and store each block
+# "dimension first" - value 0 of all 64 documents, then value 1 of all 64...
+# Shape (n_blocks, D, 64); the last block is padded with zeros.
+# A search can then load query[d] once and use it for 64 documents in a row,
+# instead of walking one document at a time.
+def to_pdx(vectors, block=PDX_BLOCK):
+    n, d = vectors.shape
+    n_blocks = -(-n // block)
+    padded = np.zeros((n_blocks * block, d), dtype=np.float32)
+    padded[:n] = vectors
+    return np.ascontiguousarray(padded.reshape(n_blocks, block, d).transpose(0, 2, 1))
+
+
+class SmallIndex:
+    # quantize="int8" or "binary" also stores a compressed copy of every
+    # embedding. Searches first scan that small copy to find the most
+    # promising documents, then re-check only those with the full-precision
+    # vectors. `rerank` is how many candidates we re-check PER result asked
+    # for, so n_results=5 with rerank=10 re-checks the best 50.
+    # - "int8":   1 byte per value (4x smaller than float32), rerank 10.
+    #             Only faster with simsimd installed; plain numpy saves the
+    #             memory but scans no faster than the float32 search.
+    # - "binary": 1 BIT per value (32x smaller), compared by counting the
+    #             bits that differ (Hamming distance), rerank 100
+    # cluster_sort=True stores similar documents next to each other (see
+    # cluster_order); worthwhile for large indexes that are built once.
+    # kernel="pdx" (needs numba) searches a PDX copy with the compiled kernel
+    # in pdx_kernel.py. It's off by default: numpy's matrix product (BLAS) is
+    # usually faster, so only use it if it measures faster on your machine.
+    def __init__(self, documents, embeddings, ids=None, metadatas=None,
+                 quantize=None, rerank=None, cluster_sort=False, kernel=None):
+        n = len(documents)
+        self.documents = _object_array(documents)
+        self.ids = _object_array(ids if ids is not None else [str(i) for i in range(n)])
+        self.metadatas = _object_array(metadatas if metadatas is not None else [None] * n)
+        # One contiguous, 64-byte aligned (N, D) float32 block: a search is a
+        # single matrix-vector product over it
+        vectors = normalize(embeddings)
+        if cluster_sort:
+            order = cluster_order(vectors)
+            vectors = vectors[order]
+            self.documents = self.documents[order]
+            self.ids = self.ids[order]
+            self.metadatas = self.metadatas[order]
+        self.embeddings = aligned_empty(vectors.shape)
+        self.embeddings[...] = vectors
+        # kernel="pdx": also keep a PDX copy for the compiled distance kernel
+        # (numba is only imported here, so other searches never pay for it)
+        self._pdx = None
+        if kernel == "pdx":
+            try:
+                from pdx_kernel import pdx_inner
+            except ImportError as e:
+                raise ImportError("kernel='pdx' needs numba: pip install numba") from e
+            self._pdx_inner = pdx_inner
+            self._pdx = to_pdx(self.embeddings)
+        elif kernel is not None:
+            raise ValueError(f"kernel must be None or 'pdx', not {kernel!r}")
+        # With cupy and a very large index, keep a copy in GPU memory so every
+        # search runs there instead of on the CPU
+        self._gpu = None
+        if len(self.documents) >= GPU_MIN_DOCS:
+            self._cp = _load_cupy()
+            if self._cp is not None:
+                self._gpu = self._cp.asarray(self.embeddings)
+        self.quantize = quantize
+        self.rerank = rerank or _DEFAULT_RERANK.get(quantize, 0)
+        self.codes = None
+        if quantize == "int8":
+            # One scale for everything: the largest value becomes 127. Zero
+            # stays zero (no offset), so the dot product of two int8 codes is
+            # just the float dot product times a constant - same ranking.
+            self._scale = 127.0 / max(float(np.abs(self.embeddings).max()), 1e-12)
+            self.codes = self._quantize(self.embeddings)
+        elif quantize == "binary":
+            self.codes = self._quantize(self.embeddings)
+        elif quantize is not None:
+            raise ValueError(f"quantize must be None, 'int8' or 'binary', not {quantize!r}")
+
+    def _quantize(self, vectors):
+        if self.quantize == "binary":
+            # Keep only the sign of each value, 8 values packed per byte
+            # (384 dimensions -> 48 bytes)
+            return np.packbits(vectors > 0, axis=1)
+        scaled = vectors * self._scale
+        return np.clip(np.rint(scaled), -127, 127).astype(np.int8)
+
+    # Cosine distance from every query (rows) to every document (columns)
+    def distances(self, query_vecs):
+        queries = normalize(query_vecs)
+        if self._gpu is not None:
+            scores = self._cp.asarray(queries) @ self._gpu.T
+            return self._cp.asnumpy(1.0 - scores)
+        if self._pdx is not None:
+            scores = self._pdx_inner(self._pdx, queries)[:, :len(self.documents)]
+            return 1.0 - scores
+        if simsimd is not None:
+            return np.asarray(simsimd.cdist(queries, self.embeddings, metric="cosine"))
+        return 1.0 - queries @ self.embeddings.T
+
+    # Rough distances computed on the compressed copies
+    def _coarse_distances(self, query_vecs):
+        query_codes = self._quantize(normalize(query_vecs))
+        if self.quantize == "binary":
+            if simsimd is not None:
+                return np.asarray(simsimd.cdist(
+                    query_codes, self.codes, metric="hamming", dtype="bin8"
+                ))
+            # One query at a time, so the temporary XOR result is only
+            # (documents x 48 bytes); bitwise_count counts the 1-bits per byte
+            # without unpacking them 8x
+            distances = np.empty((len(query_codes), len(self.codes)), dtype=np.int32)
+            for row, code in enumerate(query_codes):
+                differing = np.bitwise_xor(self.codes, code)
+                distances[row] = np.bitwise_count(differing).sum(axis=1, dtype=np.int32)
+            return distances
+        # The codes are the unit vectors times one constant, so cosine on the
+        # codes ranks documents like cosine on the real vectors
+        if simsimd is not None:
+            return np.asarray(simsimd.cdist(query_codes, self.codes, metric="cosine"))
+        # numpy has no fast int8 matrix product, so we turn a slice of codes
+        # at a time into float32 (a small temporary copy) and let BLAS
+        # multiply it. A bigger dot product means closer, so we flip the sign.
+        queries = query_codes.astype(np.float32)
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), INT8_BLOCK):
+            block = self.codes[start:start + INT8_BLOCK].astype(np.float32)
+            scores[:, start:start + INT8_BLOCK] = queries @ block.T
+        return -scores
+
+    # Returns the n_results closest matches for each query, closest first,
+    # as ONE numpy array of shape (queries, n_results) with the fields
+    # "id", "doc", "dist" and "meta" - e.g. results[0][0]["doc"].
+    # That's a single allocation instead of ChromaDB's lists of lists.
+    def search(self, query_vecs, n_results=1):
+        k = min(n_results, len(self.documents))
+        queries = normalize(query_vecs)
+        results = np.empty((len(queries), k), dtype=RESULT_DTYPE)
+
+        n_candidates = self.rerank * k
+        if self.codes is None or len(self.documents) <= n_candidates:
+            dists = self.distances(queries)
+            for row, row_dists in enumerate(dists):
+                positions = top_k(row_dists, k)
+                self._fill(results[row], positions, row_dists[positions])
+            return results
+
+        rough = self._coarse_distances(queries)
+        for row, query in enumerate(queries):
+            candidates = top_k(rough[row], n_candidates)
+            exact = 1.0 - self.embeddings[candidates] @ query
+            best = top_k(exact, k)
+            self._fill(results[row], candidates[best], exact[best])
+        return results
+
+    def _fill(self, out, positions, dists):
+        out["id"] = self.ids[positions]
+        out["doc"] = self.documents[positions]
+        out["dist"] = dists
+        out["meta"] = self.metadatas[positions]
+
+
+# Layout of one search result in SmallIndex.search()
+# ("O" = any Python object, so ids and documents of any length fit)
+RESULT_DTYPE = np.dtype([("id", "O"), ("doc", "O"), ("dist", "f4"), ("meta", "O")])
+
+
+# A numpy array of arbitrary Python objects (strings, dicts, None...)
+def _object_array(items):
+    array = np.empty(len(items), dtype=object)
+    array[:] = list(items)
+    return array
+
+
+# Fast path for the most common question: "what is THE best match?"
+# Asks a ChromaDB collection for a single result and only the two fields we
+# show (document and distance), then returns them as a plain
+# (document, distance) pair instead of nested lists. Pass `embedding` if the
+# question has already been embedded, so ChromaDB can skip that step too.
+def query_one(collection, text, embedding=None):
+    if embedding is None:
+        result = collection.query(
+            query_texts=[text], n_results=1, include=["documents", "distances"]
+        )
+    else:
+        result = collection.query(
+            query_embeddings=[embedding], n_results=1, include=["documents", "distances"]
+        )
+    return result["documents"][0][0], result["distances"][0][0]
+
+
+# How many candidates each compressed scan passes on to the exact re-check
+_DEFAULT_RERANK = {"int8": 10, "binary": 100}
+
+
+# Positions of the k smallest distances, smallest first.
+# A full sort orders ALL documents; we only need the best k, so:
+# - k=1: argmin is a single pass over the distances
+# - k>1: argpartition moves the k best to the front (no full sort), then we
+#   sort just those k
+def top_k(dists, k):
+    k = min(k, len(dists))
+    if k == 1:
+        return np.array([np.argmin(dists)])
+    if k == len(dists):
+        return np.argsort(dists)
+    best = np.argpartition(dists, k)[:k]
+    return best[np.argsort(dists[best])]